@@ -1,3 +1,4 @@
+import sys
 import os
 import argparse
 import sqlite3
@@ -5,6 +6,8 @@ import ipaddress
 import json
 from datetime import datetime, date
 from network_tree import NetworkNode, NetworksHierarchicalTree
+from connect_data import OPEN_END
+from archive import checkout
 
 
 def get_iana_allocation(iana_path: str):
@@ -45,27 +48,140 @@ def print_internet_coverage(all_networks: list, ip_type: str, iana_allocated: li
     print(f'IANA allocated {nb_ip_iana} {ip_type}, {nb_ip_iana/nb_ip_max*100:.2f}% of the space')
     print(f'Found {len(collapsed)} non-overlapping networks {ip_type}, accounting for {nb_ip_not_iana} {ip_type}, {nb_ip_not_iana/nb_ip_iana*100:.2f}% of IANA allocation')
 
+def get_registry_blocks(db_path: str, day: str):
+    # status, cc and RIR of every block of the stats on a given day, in a single pass on the timeline
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    statuses = {row['id']: row['value'] for row in cursor.execute('SELECT id, value FROM status').fetchall()}
+    ccs = {row['id']: row['value'] for row in cursor.execute('SELECT id, value FROM cc').fetchall()}
+    rirs = {row['id']: os.path.basename(row['value']).split('_')[0] for row in cursor.execute('SELECT id, value FROM source').fetchall()}
 
-def get_asn_changes_for_date(db_path: str, day: str):
+    blocks = {}
+    events = cursor.execute((
+        'SELECT t.inetnum_id AS inetnum_id, t.change_type AS change_type, t.new_value AS new_value, '
+        't.date_download AS date_download, t.id AS id, t.source_id AS source_id, net.value AS value, net.ip_type AS ip_type '
+        'FROM timeline_inetnum AS t JOIN inetnum AS net ON t.inetnum_id = net.id '
+        "WHERE t.change_type IN ('status', 'cc') AND t.date_download <= ?"
+    ), (int(day),))
+    for event in events:
+        block = blocks.setdefault(event['inetnum_id'], {'value': event['value'], 'ip_type': event['ip_type'], 'last': (0, 0)})
+        last = (event['date_download'], event['id'])
+        if last > block.get(event['change_type'] + '_last', (0, 0)):
+            block[event['change_type'] + '_last'] = last
+            block[event['change_type']] = event['new_value']
+        if last > block['last']:
+            block['last'] = last
+            block['rir'] = rirs[event['source_id']]
+    conn.close()
+
+    return [
+        {'value': b['value'], 'ip_type': b['ip_type'], 'status': statuses[b['status']], 'cc': ccs[b['cc']], 'rir': b['rir']}
+        for b in blocks.values() if 'status' in b and 'cc' in b
+    ]
+
+def get_grouped_coverage(blocks: list, dimensions: list):
+    # blocks become integer intervals [start, end[ keyed by group, sorted once and swept once:
+    # overlapping intervals of a same group and status are merged so that space is not counted twice
+    intervals = []
+    for block in blocks:
+        net = ipaddress.ip_network(block['value'])
+        start = int(net.network_address)
+        end = start + net.num_addresses
+        for dimension in dimensions:
+            for status in [block['status'], 'total']:
+                intervals.append((dimension, block[dimension], block['ip_type'], status, start, end))
+    intervals.sort()
+
+    coverage = {}
+    current_key = None
+    current_end = 0
+    for dimension, group, ip_type, status, start, end in intervals:
+        key = (dimension, group, ip_type, status)
+        if key != current_key:
+            current_key = key
+            current_end = 0
+            coverage[key] = {'nb_ips': 0, 'nb_blocks': 0}
+        coverage[key]['nb_blocks'] += 1
+        if end > current_end:
+            coverage[key]['nb_ips'] += end - max(start, current_end)
+            current_end = end
+
+    return coverage
+
+def print_grouped_coverage(coverage: dict, dimension: str, ip_type: str):
+    groups = {key[1] for key in coverage if key[0] == dimension and key[2] == ip_type}
+    groups = sorted(groups, key=lambda group: coverage[(dimension, group, ip_type, 'total')]['nb_ips'], reverse=True)
+    for group in groups:
+        total = coverage[(dimension, group, ip_type, 'total')]
+        by_status = []
+        for status in ['allocated', 'assigned', 'available', 'reserved']:
+            nb_ips = coverage.get((dimension, group, ip_type, status), {'nb_ips': 0})['nb_ips']
+            by_status.append(f'{status} {nb_ips}')
+        print(f"{group}: {total['nb_ips']} {ip_type} in {total['nb_blocks']} networks ({', '.join(by_status)})")
+
+
+def get_changes_filters(table: str, key_column: str, filters: dict, day: int):
+    # SQL conditions on timeline events, so that filtered out events never leave sqlite.
+    # A block/ASN matches a cc, org or asn when it has this value on that day, or loses it that day.
+    clauses = []
+    params = []
+    if filters.get('change_type'):
+        clauses.append(f'AND t.change_type IN ({",".join(["?"] * len(filters["change_type"]))}) ')
+        params.extend(filters['change_type'])
+    if filters.get('min_prefix') is not None and table == 'timeline_inetnum':
+        clauses.append('AND net.cidr >= ? ')
+        params.append(filters['min_prefix'])
+    if filters.get('max_prefix') is not None and table == 'timeline_inetnum':
+        clauses.append('AND net.cidr <= ? ')
+        params.append(filters['max_prefix'])
+    if filters.get('asn') is not None and table == 'timeline_asn':
+        clauses.append('AND t.asn = ? ')
+        params.append(filters['asn'])
+
+    for change_type in ['cc', 'org', 'asn']:
+        if filters.get(change_type) is None or (change_type == 'asn' and table == 'timeline_asn'):
+            continue
+
+        if change_type == 'cc':
+            values_sql, value = 'SELECT id FROM cc WHERE value = ?', filters['cc'].upper()
+        elif change_type == 'org':
+            values_sql, value = 'SELECT id FROM org WHERE value LIKE ?', f"%{filters['org'].lower()}%"
+        else:
+            values_sql, value = 'SELECT ?', filters['asn']
+
+        clauses.append((
+            f'AND ((SELECT c.new_value FROM {table} AS c '
+            f"WHERE c.{key_column} = t.{key_column} AND c.change_type = '{change_type}' AND c.date_download <= ? "
+            f'ORDER BY c.date_download DESC, c.id DESC LIMIT 1) IN ({values_sql}) '
+            f'OR t.{key_column} IN (SELECT d.{key_column} FROM {table} AS d '
+            f"WHERE d.date_download = ? AND d.change_type = '{change_type}' AND d.old_value IN ({values_sql}))) "
+        ))
+        params.extend([day, value, day, value])
+
+    return ''.join(clauses), params
+
+def get_asn_changes_for_date(db_path: str, day: str, filters: dict = None):
     conn = sqlite3.connect(db_path)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     asns = {}
 
+    filters_sql, filters_params = get_changes_filters('timeline_asn', 'asn', filters or {}, int(day))
     events = cursor.execute((
         'SELECT t.asn as asn, t.change_type as change_type, t.old_value as old_value_id, t.new_value as new_value_id '
         'FROM timeline_asn AS t '
-        'WHERE date_download = ? '
-    ), (day,)).fetchall()
+        'WHERE t.date_download = ? '
+        f'{filters_sql}'
+    ), (int(day), *filters_params)).fetchall()
     for event in events:
-        print(event['asn'], event['change_type'], event['old_value_id'], event['new_value_id'])
         if event['asn'] not in asns:
             asns[event['asn']] = {
                 'asn': event['asn'],
             }
 
         old_value = None
-        if event['old_value_id'] == '':
+        if event['old_value_id'] is None:
             old_value = 'n/a'
 
         if event['change_type'] == 'aso':
@@ -102,19 +218,21 @@ def get_asn_changes_for_date(db_path: str, day: str):
     return asns
 
 
-def get_network_changes_for_date(db_path: str, day: str):
+def get_network_changes_for_date(db_path: str, day: str, filters: dict = None):
     conn = sqlite3.connect(db_path)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     networks = {}
 
+    filters_sql, filters_params = get_changes_filters('timeline_inetnum', 'inetnum_id', filters or {}, int(day))
     events = cursor.execute((
         'SELECT net.id as inetnum_id, net.value as inetnum, net.ip_type as ip_type, '
         't.change_type as change_type, t.old_value as old_value_id, t.new_value as new_value_id '
         'FROM timeline_inetnum AS t ' 
         'JOIN inetnum AS net ON t.inetnum_id = net.id '
-        'WHERE date_download = ? '
-    ), (day,)).fetchall()
+        'WHERE t.date_download = ? '
+        f'{filters_sql}'
+    ), (int(day), *filters_params)).fetchall()
     for event in events:
         if event['inetnum'] not in networks:
             net = ipaddress.ip_network(event['inetnum'])
@@ -129,14 +247,15 @@ def get_network_changes_for_date(db_path: str, day: str):
             }
 
         old_value = None
-        if event['old_value_id'] == '':
+        if event['old_value_id'] is None:
             old_value = 'n/a'
 
         if event['change_type'] == 'asn':
             old_asn = old_value
             if old_value is None:
-                old_asn = event['old_value_id']
-            networks[event['inetnum']]['asn'] = old_asn + '->' + event['new_value_id']        
+                old_asn = str(event['old_value_id'])
+            new_asn = str(event['new_value_id']) if event['new_value_id'] is not None else 'n/a'
+            networks[event['inetnum']]['asn'] = old_asn + '->' + new_asn        
         elif event['change_type'] == 'org':
             old_org = old_value
             if old_value is None:
@@ -165,21 +284,23 @@ def get_network_changes_for_date(db_path: str, day: str):
     conn.close()
     return networks
 
+# change types of timeline_inetnum
+INETNUM_CHANGE_TYPES = ['status', 'requestor', 'cc', 'org', 'asn']
+
 def get_parent(db_path: str, network_id: int, day: str):
     conn = sqlite3.connect(db_path)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
 
     parent_id = cursor.execute((
-        'SELECT supernet_inetnum_id, first_seen '
-        'FROM inetnum2supernet WHERE inetnum_id = ? '
-        'ORDER BY first_seen DESC LIMIT 1'
-        ), (network_id,)).fetchone()
+        'SELECT supernet_inetnum_id, valid_from '
+        'FROM inetnum2supernet WHERE inetnum_id = ? AND valid_from <= ? AND valid_to > ?'
+        ), (network_id, int(day), int(day))).fetchone()
 
     if parent_id is None:
         return None
     
-    parent_since = parent_id['first_seen']
+    parent_since = parent_id['valid_from']
     parent_id = parent_id['supernet_inetnum_id']
     parent = cursor.execute('SELECT value, ip_type FROM inetnum WHERE id = ?', (parent_id,)).fetchone()
     parent_network = ipaddress.ip_network(parent['value'], strict=False)
@@ -191,41 +312,234 @@ def get_parent(db_path: str, network_id: int, day: str):
         'cidr': parent_network.prefixlen,
         'nb_ips': parent_network.num_addresses,
         'ip_type': parent['ip_type'],
-        'desc': desc
     })
 
-    last_event_parent = cursor.execute(
-        (
-            'SELECT change_type, date_download '
-            'FROM timeline_inetnum ' 
-            'WHERE inetnum_id = ? AND CAST(date_download AS integer) <= ? '
-            'ORDER BY date_download DESC LIMIT 1'
-        ), (parent_id, day)
-    ).fetchone()
+    # last event of each change type is an index seek, the latest of them is kept
+    last_event_parent = None
+    for change_type in INETNUM_CHANGE_TYPES:
+        event = cursor.execute(
+            (
+                'SELECT change_type, date_download, id '
+                'FROM timeline_inetnum ' 
+                'WHERE inetnum_id = ? AND change_type = ? AND date_download <= ? '
+                'ORDER BY date_download DESC, id DESC LIMIT 1'
+            ), (parent_id, change_type, int(day))
+        ).fetchone()
+        if event is not None and (last_event_parent is None or (event['date_download'], event['id']) > (last_event_parent['date_download'], last_event_parent['id'])):
+            last_event_parent = event
     if last_event_parent is not None:
         desc += f', and has last change on {last_event_parent["date_download"]} concerning {last_event_parent["change_type"]}'
-    parent_node.desc = desc
+    parent_node.context = desc
 
     conn.close()
     return parent_node
 
+def get_inetnum_id(db_path: str, network: str):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    value = ipaddress.ip_network(network, strict=False).compressed
+    inetnum = cursor.execute('SELECT id FROM inetnum WHERE value = ?', (value,)).fetchone()
+    conn.close()
+
+    return inetnum['id'] if inetnum is not None else None
+
+def get_parent_chain(db_path: str, network_id: int, day: str):
+    # supernets of a network on a given day, from the closest to the root
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+
+    chain = cursor.execute((
+        'WITH RECURSIVE chain(inetnum_id, valid_from, valid_to, depth) AS ('
+        'SELECT ?, NULL, NULL, 0 '
+        'UNION ALL '
+        'SELECT e.supernet_inetnum_id, e.valid_from, e.valid_to, chain.depth + 1 '
+        'FROM chain JOIN inetnum2supernet AS e ON e.inetnum_id = chain.inetnum_id '
+        'WHERE e.valid_from <= ? AND e.valid_to > ?'
+        ') '
+        'SELECT net.value AS value, chain.valid_from AS valid_from, chain.valid_to AS valid_to '
+        'FROM chain JOIN inetnum AS net ON net.id = chain.inetnum_id '
+        'WHERE chain.depth > 0 ORDER BY chain.depth'
+    ), (network_id, int(day), int(day))).fetchall()
+
+    conn.close()
+    return chain
+
+def get_children(db_path: str, network_id: int, day: str):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+
+    children = cursor.execute((
+        'SELECT net.value AS value, e.valid_from AS valid_from, e.valid_to AS valid_to '
+        'FROM inetnum2supernet AS e JOIN inetnum AS net ON net.id = e.inetnum_id '
+        'WHERE e.supernet_inetnum_id = ? AND e.valid_from <= ? AND e.valid_to > ? '
+        'ORDER BY net.value'
+    ), (network_id, int(day), int(day))).fetchall()
+
+    conn.close()
+    return children
+
+def print_relationship(relationship: dict, prefix: str):
+    until = 'now' if relationship['valid_to'] == OPEN_END else relationship['valid_to']
+    print(f"{prefix}{relationship['value']} (from {relationship['valid_from']} until {until})")
+
+def get_asn_prefixes(db_path: str, asn: int, day: str):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+
+    prefixes = cursor.execute((
+        'SELECT net.value AS value, a.valid_from AS valid_from, a.valid_to AS valid_to '
+        'FROM asn2inetnum AS a JOIN inetnum AS net ON net.id = a.inetnum_id '
+        'WHERE a.asn = ? AND a.valid_from <= ? AND a.valid_to > ? '
+        'ORDER BY net.ip_type, net.value'
+    ), (asn, int(day), int(day))).fetchall()
+
+    conn.close()
+    return prefixes
+
+def get_asn_history(db_path: str, asn: int):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+
+    history = cursor.execute((
+        'SELECT net.value AS value, a.valid_from AS valid_from, a.valid_to AS valid_to '
+        'FROM asn2inetnum AS a JOIN inetnum AS net ON net.id = a.inetnum_id '
+        'WHERE a.asn = ? '
+        'ORDER BY a.valid_from, net.value'
+    ), (asn,)).fetchall()
+
+    conn.close()
+    return history
+
+# change types with rollups, the values of --movers and --trend
+MOVERS_TYPES = ['org', 'asn', 'cc', 'requestor', 'status']
+VALUE_TABLES = {'org': 'org', 'requestor': 'requestor', 'cc': 'cc', 'status': 'status', 'aso': 'aso'}
+
+def get_value_label(cursor: sqlite3.Cursor, change_type: str, value_id: int):
+    if change_type not in VALUE_TABLES:
+        return str(value_id)
+    value = cursor.execute(f'SELECT value FROM {VALUE_TABLES[change_type]} WHERE id = ?', (value_id,)).fetchone()
+    return value['value'] if value is not None else 'n/a'
+
+def get_value_ids(cursor: sqlite3.Cursor, change_type: str, value: str):
+    # org are matched on substring, other attributes on the exact value
+    if change_type not in VALUE_TABLES:
+        return [int(value)]
+    if change_type == 'org':
+        rows = cursor.execute('SELECT id FROM org WHERE value LIKE ?', (f'%{value.lower()}%',)).fetchall()
+    else:
+        rows = cursor.execute(f'SELECT id FROM {VALUE_TABLES[change_type]} WHERE value = ?', (value,)).fetchall()
+    return [row['id'] for row in rows]
+
+def get_top_movers(db_path: str, change_type: str, ip_type: str, day_from: str, day_to: str, limit: int):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+
+    movers = cursor.execute((
+        'SELECT value_id, SUM(addresses_gained) AS addresses_gained, SUM(addresses_lost) AS addresses_lost, '
+        'SUM(prefixes_gained) AS prefixes_gained, SUM(prefixes_lost) AS prefixes_lost '
+        'FROM rollup_daily '
+        'WHERE change_type = ? AND day BETWEEN ? AND ? AND ip_type = ? '
+        'GROUP BY value_id '
+        'ORDER BY MAX(SUM(addresses_gained), SUM(addresses_lost)) DESC LIMIT ?'
+    ), (change_type, int(day_from), int(day_to), ip_type, limit)).fetchall()
+    movers = [dict(mover, value=get_value_label(cursor, change_type, mover['value_id'])) for mover in movers]
+
+    conn.close()
+    return movers
+
+def get_trend(db_path: str, change_type: str, value: str, day_from: str, day_to: str):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+
+    value_ids = get_value_ids(cursor, change_type, value)
+    trend = cursor.execute((
+        'SELECT day, ip_type, SUM(addresses_gained) AS addresses_gained, SUM(addresses_lost) AS addresses_lost, '
+        'SUM(prefixes_gained) AS prefixes_gained, SUM(prefixes_lost) AS prefixes_lost '
+        'FROM rollup_daily '
+        f'WHERE change_type = ? AND value_id IN ({",".join(["?"] * len(value_ids))}) AND day BETWEEN ? AND ? '
+        'GROUP BY day, ip_type ORDER BY day, ip_type'
+    ), (change_type, *value_ids, int(day_from), int(day_to))).fetchall()
+
+    conn.close()
+    return trend
+
+def get_holdings(db_path: str, holder_type: str, value: str, day: str):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+
+    # one query per holder, so that sqlite pushes the holder down to the indexes of the view
+    holdings = []
+    for holder_id in get_value_ids(cursor, holder_type, value):
+        rows = cursor.execute((
+            'SELECT via, ip_type, SUM(addresses) AS addresses, SUM(prefixes) AS prefixes '
+            'FROM holdings '
+            'WHERE holder_type = ? AND holder_id = ? AND day <= ? AND valid_from <= ? AND valid_to > ? '
+            'GROUP BY via, ip_type ORDER BY via, ip_type'
+        ), (holder_type, holder_id, int(day), int(day), int(day))).fetchall()
+        label = get_value_label(cursor, holder_type, holder_id)
+        holdings.extend([dict(row, value=label) for row in rows])
+
+    conn.close()
+    return holdings
+
+def print_movement(label: str, movement: dict):
+    unit = 'ipv4' if movement['ip_type'] == 'ipv4' else '/64'
+    net = movement['addresses_gained'] - movement['addresses_lost']
+    print((
+        f"{label}: +{movement['addresses_gained']} -{movement['addresses_lost']} (net {net:+}) {unit}, "
+        f"+{movement['prefixes_gained']} -{movement['prefixes_lost']} prefixes"
+    ))
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--date', type=str, help='Date of the Internet picture. Default is today. Format is %%Y%%m%%d', default=None)
     parser.add_argument('--coverage', action='store_true', help='Print Internet coverage')
+    parser.add_argument('--coverage-by', type=str, nargs='+', choices=['cc', 'rir'], help='Print the space allocated, assigned, available and reserved per country and/or per RIR', default=None)
     parser.add_argument('--changes', action='store_true', help='Print networks changes')
+    parser.add_argument('--format', type=str, choices=['text', 'json', 'ndjson'], help='Format of --changes: text tree, nested JSON or one JSON node per line (networks only)', default='text')
+    parser.add_argument('--output', type=str, help='File where --changes is written. Default is stdout', default=None)
+    parser.add_argument('--cc', type=str, help='Filter --changes on a country code', default=None)
+    parser.add_argument('--org', type=str, help='Filter --changes on organizations containing this name', default=None)
+    parser.add_argument('--asn', type=int, help='Filter --changes on an ASN', default=None)
+    parser.add_argument('--min-prefix', type=int, help='Filter --changes on networks with a prefix length of at least this value', default=None)
+    parser.add_argument('--max-prefix', type=int, help='Filter --changes on networks with a prefix length of at most this value', default=None)
+    parser.add_argument('--change-type', type=str, nargs='+', choices=['asn', 'org', 'requestor', 'cc', 'status', 'aso'], help='Filter --changes on the type of change', default=None)
+    parser.add_argument('--hierarchy', type=str, help='Print the supernets and subnets of a network at --date', default=None)
+    parser.add_argument('--asn-prefixes', type=int, help='Print the prefixes announced by an ASN at --date', default=None)
+    parser.add_argument('--asn-history', type=int, help='Print every prefix announced by an ASN over time', default=None)
+    parser.add_argument('--holdings', type=str, nargs=2, metavar=('org|requestor', 'VALUE'), help='Print the address space held at --date by orgs containing a name, or by a requestor ID', default=None)
+    parser.add_argument('--movers', type=str, choices=MOVERS_TYPES, help='Print the values which gained or lost the most address space', default=None)
+    parser.add_argument('--trend', type=str, nargs=2, metavar=('CHANGE_TYPE', 'VALUE'), help='Print the daily address space moved for a value, like "org microsoft"', default=None)
+    parser.add_argument('--since', type=str, help='First day of the window for --movers and --trend. Default is --date. Format is %%Y%%m%%d', default=None)
+    parser.add_argument('--limit', type=int, help='Number of values printed by --movers', default=20)
     args = parser.parse_args()
+    if args.holdings is not None and args.holdings[0] not in ['org', 'requestor']:
+        parser.error(f"argument --holdings: invalid type '{args.holdings[0]}' (choose from 'org', 'requestor')")
+    if args.trend is not None and args.trend[0] not in MOVERS_TYPES:
+        parser.error(f"argument --trend: invalid change type '{args.trend[0]}' (choose from {', '.join(repr(t) for t in MOVERS_TYPES)})")
+    if args.trend is not None and args.trend[0] == 'asn' and not args.trend[1].isdigit():
+        parser.error(f"argument --trend: invalid ASN '{args.trend[1]}'")
 
     if args.date is None:
         args.date = datetime.strftime(datetime.today(), '%Y%m%d')
+    if args.since is None:
+        args.since = args.date
 
     project_path = os.path.dirname(os.path.abspath(__file__))
     db_path = os.path.join(project_path, 'db', 'vizir.sqlite3')
 
     if args.coverage is True:
-        iana_path = os.path.join(project_path, 'data', 'iana', args.date)
-        iana_allocated = get_iana_allocation(iana_path)
+        with checkout(os.path.join(project_path, 'data'), 'iana', args.date) as iana_path:
+            iana_allocated = get_iana_allocation(iana_path)
 
         print(f'\n[+] IPv4 report coverage')
         all_ipv4 = get_networks(db_path, 'ipv4')
@@ -235,10 +549,24 @@ if __name__ == '__main__':
         all_ipv6 = get_networks(db_path, 'ipv6')
         print_internet_coverage(all_ipv6, 'ipv6', iana_allocated['ipv6'])
 
+    if args.coverage_by is not None:
+        blocks = get_registry_blocks(db_path, args.date)
+        coverage = get_grouped_coverage(blocks, args.coverage_by)
+        for dimension in args.coverage_by:
+            for ip_type in ['ipv4', 'ipv6']:
+                print(f'\n[+] {ip_type} report coverage per {dimension} on {args.date}')
+                print_grouped_coverage(coverage, dimension, ip_type)
+
     if args.changes is True:
         # networks changes
-        networks = get_network_changes_for_date(db_path, args.date)
-        print(f'\n[+] Network changes seen on {args.date} ({len(networks)} found)')
+        filters = {
+            'cc': args.cc, 'org': args.org, 'asn': args.asn, 'change_type': args.change_type,
+            'min_prefix': args.min_prefix, 'max_prefix': args.max_prefix,
+        }
+        networks = get_network_changes_for_date(db_path, args.date, filters)
+        sink = open(args.output, mode='w', encoding='utf8') if args.output is not None else sys.stdout
+        if args.format == 'text':
+            sink.write(f'\n[+] Network changes seen on {args.date} ({len(networks)} found)\n')
         tree = NetworksHierarchicalTree(list(networks.values()))
         for network in networks.values():
             tree.nodes[network['value']].desc = {k: v for k, v in network.items() if k in ['asn','org', 'requestor', 'cc', 'status']}
@@ -250,10 +578,63 @@ if __name__ == '__main__':
             if parent is not None:
                 tree.nodes[parent.block] = parent
         tree.build()
-        tree.print_tree()
-
-        # asns changes
-        asns = get_asn_changes_for_date(db_path, args.date)
-        print(f'\n[+] ASN changes seen on {args.date} ({len(asns)} found)')
-        for asn in asns.values():
-            print(asn)
+        tree.render(sink, args.format)
+
+        # asns changes, only part of the text report
+        if args.format == 'text':
+            asns = get_asn_changes_for_date(db_path, args.date, filters)
+            sink.write(f'\n[+] ASN changes seen on {args.date} ({len(asns)} found)\n')
+            for asn in asns.values():
+                sink.write(f'{asn}\n')
+        if sink is not sys.stdout:
+            sink.close()
+
+    if args.hierarchy is not None:
+        network_id = get_inetnum_id(db_path, args.hierarchy)
+        if network_id is None:
+            print(f'\n[+] {args.hierarchy} not found')
+        else:
+            chain = get_parent_chain(db_path, network_id, args.date)
+            children = get_children(db_path, network_id, args.date)
+            print(f'\n[+] Hierarchy of {args.hierarchy} on {args.date} ({len(chain)} supernets, {len(children)} subnets)')
+            for supernet in reversed(chain):
+                print_relationship(supernet, 'supernet ')
+            for child in children:
+                print_relationship(child, 'subnet ')
+
+    if args.asn_prefixes is not None:
+        prefixes = get_asn_prefixes(db_path, args.asn_prefixes, args.date)
+        print(f'\n[+] Prefixes announced by AS{args.asn_prefixes} on {args.date} ({len(prefixes)} found)')
+        for prefix in prefixes:
+            print_relationship(prefix, '')
+
+    if args.asn_history is not None:
+        history = get_asn_history(db_path, args.asn_history)
+        print(f'\n[+] Prefixes announced by AS{args.asn_history} over time ({len(history)} found)')
+        for prefix in history:
+            print_relationship(prefix, '')
+
+    if args.holdings is not None:
+        holder_type, value = args.holdings
+        holdings = get_holdings(db_path, holder_type, value, args.date)
+        print(f'\n[+] Holdings of {holder_type} {value} on {args.date}')
+        for holding in holdings:
+            unit = 'ipv4' if holding['ip_type'] == 'ipv4' else '/64'
+            if holding['via'] == 'net transfer':
+                print(f"{holding['value']} (net transfers, not a holding): {holding['addresses']:+} {unit} in {holding['prefixes']:+} prefixes")
+            else:
+                print(f"{holding['value']} (via {holding['via']}): {holding['addresses']} {unit} in {holding['prefixes']} prefixes")
+
+    if args.movers is not None:
+        for ip_type in ['ipv4', 'ipv6']:
+            movers = get_top_movers(db_path, args.movers, ip_type, args.since, args.date, args.limit)
+            print(f'\n[+] Top {args.movers} movers {ip_type} between {args.since} and {args.date} ({len(movers)} found)')
+            for mover in movers:
+                print_movement(mover['value'], dict(mover, ip_type=ip_type))
+
+    if args.trend is not None:
+        change_type, value = args.trend
+        trend = get_trend(db_path, change_type, value, args.since, args.date)
+        print(f'\n[+] Trend of {change_type} {value} between {args.since} and {args.date}')
+        for movement in trend:
+            print_movement(f"{movement['day']} {movement['ip_type']}", movement)
@@ -0,0 +1,200 @@
+import sys
+import os
+import json
+import gzip
+import shutil
+import hashlib
+from contextlib import contextmanager
+
+
+# raw downloads are moved under data/archive:
+# - objects/<sha256[:2]>/<sha256>.gz holds each distinct file content once, either in full or as a line delta against another object
+# - manifests/<YYYYMMDD>.json maps <source>/<filename> of that day to the sha256 of its content, prefixed with gz: for a gzip
+#   downloaded file whose decompressed content is archived, so that daily snapshots like ip2asn can be line deltas
+SOURCES = ['stats', 'transfers', 'iana', 'asn', 'ip2asn']
+TEXT_EXTENSIONS = ('.txt', '.json', '.csv')
+GZIP_PREFIX = 'gz:'
+MAX_DELTA_CHAIN = 7
+
+
+def _archive_path(data_path: str, *parts: str):
+    return os.path.join(data_path, 'archive', *parts)
+
+def _object_path(data_path: str, digest: str):
+    return _archive_path(data_path, 'objects', digest[:2], f'{digest}.gz')
+
+def _write_atomic(path: str, content: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, mode='wb') as fp:
+        fp.write(content)
+    os.replace(tmp_path, path)
+
+def _load_manifest(data_path: str, day: str):
+    manifest_path = _archive_path(data_path, 'manifests', f'{day}.json')
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, mode='r', encoding='utf8') as fp:
+        return json.load(fp)
+
+def _split_entry(entry: str):
+    # manifest entry to (sha256, whether the file is gzip compressed)
+    if entry.startswith(GZIP_PREFIX):
+        return entry[len(GZIP_PREFIX):], True
+    return entry, False
+
+def _archived_days(data_path: str):
+    manifests_path = _archive_path(data_path, 'manifests')
+    if not os.path.isdir(manifests_path):
+        return []
+    return sorted([filename[:-len('.json')] for filename in os.listdir(manifests_path) if filename.endswith('.json')])
+
+def _read_object(data_path: str, digest: str):
+    with gzip.open(_object_path(data_path, digest), mode='rb') as fp:
+        kind = fp.read(2)
+        payload = fp.read()
+    if kind == b'F\n':
+        return payload
+
+    delta = json.loads(payload)
+    base = _read_object(data_path, delta['base'])
+    base_lines = base.decode('latin-1').splitlines(keepends=True)
+    lines = []
+    for op in delta['ops']:
+        if isinstance(op, list):
+            lines.extend(base_lines[op[0]:op[1]])
+        else:
+            lines.append(op)
+    return ''.join(lines).encode('latin-1')
+
+def _object_depth(data_path: str, digest: str):
+    with gzip.open(_object_path(data_path, digest), mode='rb') as fp:
+        if fp.read(2) == b'F\n':
+            return 0
+        return json.loads(fp.read())['depth']
+
+def _line_delta(base: bytes, content: bytes):
+    # copy ranges of base lines, and literal text for what changed: a line found in base starts a copy range extended
+    # as long as the next lines match, which diffs sorted snapshots with local changes in linear time
+    base_lines = base.decode('latin-1').splitlines(keepends=True)
+    lines = content.decode('latin-1').splitlines(keepends=True)
+    first_index = {}
+    for i, line in enumerate(base_lines):
+        first_index.setdefault(line, i)
+
+    ops = []
+    literal = []
+    start = end = None
+    for line in lines:
+        if end is not None and end < len(base_lines) and base_lines[end] == line:
+            end += 1
+            continue
+        if end is not None:
+            ops.append([start, end])
+            start = end = None
+        i = first_index.get(line)
+        if i is None:
+            literal.append(line)
+            continue
+        if len(literal) > 0:
+            ops.append(''.join(literal))
+            literal = []
+        start, end = i, i + 1
+    if end is not None:
+        ops.append([start, end])
+    if len(literal) > 0:
+        ops.append(''.join(literal))
+    return ops
+
+def _store_object(data_path: str, digest: str, content: bytes, base_digest: str, is_text: bool):
+    full = gzip.compress(b'F\n' + content)
+    if base_digest is not None and is_text:
+        depth = _object_depth(data_path, base_digest) + 1
+        if depth <= MAX_DELTA_CHAIN:
+            base = _read_object(data_path, base_digest)
+            delta = json.dumps({'base': base_digest, 'depth': depth, 'ops': _line_delta(base, content)}).encode('utf8')
+            delta = gzip.compress(b'D\n' + delta)
+            if len(delta) < len(full):
+                _write_atomic(_object_path(data_path, digest), delta)
+                return 'delta'
+
+    _write_atomic(_object_path(data_path, digest), full)
+    return 'full'
+
+def _previous_digest(data_path: str, key: str, day: str):
+    for previous_day in reversed(_archived_days(data_path)):
+        if previous_day >= day:
+            continue
+        manifest = _load_manifest(data_path, previous_day)
+        if key in manifest:
+            return _split_entry(manifest[key])[0]
+    return None
+
+def archive_day(data_path: str, day: str):
+    manifest = _load_manifest(data_path, day)
+    for source in SOURCES:
+        source_path = os.path.join(data_path, source, day)
+        if not os.path.isdir(source_path):
+            continue
+
+        for filename in sorted(os.listdir(source_path)):
+            filepath = os.path.join(source_path, filename)
+            with open(filepath, mode='rb') as fp:
+                content = fp.read()
+            is_gzip = filename.endswith('.gz')
+            if is_gzip:
+                content = gzip.decompress(content)
+            digest = hashlib.sha256(content).hexdigest()
+            key = f'{source}/{filename}'
+
+            if os.path.exists(_object_path(data_path, digest)):
+                kind = 'duplicate'
+            else:
+                base_digest = _previous_digest(data_path, key, day)
+                is_text = (filename[:-len('.gz')] if is_gzip else filename).endswith(TEXT_EXTENSIONS)
+                kind = _store_object(data_path, digest, content, base_digest, is_text)
+            manifest[key] = f'{GZIP_PREFIX}{digest}' if is_gzip else digest
+            _write_atomic(_archive_path(data_path, 'manifests', f'{day}.json'), json.dumps(manifest, indent=2).encode('utf8'))
+            print(f'Archived {filepath} ({kind})')
+            os.remove(filepath)
+        os.rmdir(source_path)
+
+def list_days(data_path: str, source: str):
+    days = {day for day in _archived_days(data_path) if any(key.startswith(f'{source}/') for key in _load_manifest(data_path, day))}
+    source_path = os.path.join(data_path, source)
+    if os.path.isdir(source_path):
+        days.update([day for day in os.listdir(source_path) if os.path.isdir(os.path.join(source_path, day))])
+    return sorted(days)
+
+@contextmanager
+def checkout(data_path: str, source: str, day: str):
+    # yields data/<source>/<day>: as downloaded if still there, otherwise restored from the archive for the time of the context
+    source_path = os.path.join(data_path, source, day)
+    if os.path.isdir(source_path):
+        yield source_path
+        return
+
+    os.makedirs(source_path)
+    try:
+        for key, entry in _load_manifest(data_path, day).items():
+            if key.startswith(f'{source}/'):
+                digest, is_gzip = _split_entry(entry)
+                content = _read_object(data_path, digest)
+                if is_gzip:
+                    content = gzip.compress(content)
+                _write_atomic(os.path.join(source_path, key[len(source) + 1:]), content)
+        yield source_path
+    finally:
+        shutil.rmtree(source_path)
+
+
+if __name__ == '__main__':
+    data_path = os.path.join('.', 'data')
+
+    # archive every day still stored as downloaded, oldest first so that deltas are against the previous day
+    days = sys.argv[1:]
+    if len(days) == 0:
+        days = sorted({day for source in SOURCES if os.path.isdir(os.path.join(data_path, source)) for day in os.listdir(os.path.join(data_path, source))})
+    for day in days:
+        print(f'Archiving data of {day}')
+        archive_day(data_path, day)
@@ -3,40 +3,81 @@ import sqlite3
 import ipaddress
 from network_tree import NetworksHierarchicalTree
 
-def get_networks(db_path: str, ip_type: str):
+# valid_to of a relationship still seen
+OPEN_END = 99991231
+
+def get_networks(db_path: str, ip_type: str, day: str):
+    # networks live on a given day: blocks seen in the stats, and prefixes announced that day
     conn = sqlite3.connect(db_path)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
-    all_networks = cursor.execute(f'SELECT id, value, ip_type, cidr FROM inetnum WHERE ip_type = "{ip_type}"').fetchall()
+    all_networks = cursor.execute((
+        'SELECT id, value, ip_type, cidr FROM inetnum AS net WHERE ip_type = ? AND ('
+        "EXISTS (SELECT 1 FROM timeline_inetnum AS t WHERE t.inetnum_id = net.id AND t.change_type = 'status' AND t.date_download <= ?) "
+        'OR id IN (SELECT inetnum_id FROM asn2inetnum WHERE valid_from <= ? AND valid_to > ?)'
+        ')'
+    ), (ip_type, int(day), int(day), int(day))).fetchall()
     conn.close()
 
     return all_networks
 
-def store_supernet(db_path: str, all_networks: list, supernet_date: str):
+def _close_supernet(cursor: sqlite3.Cursor, day: int, child_id: int, parent_id: int):
+    # the relationship ended, an interval opened and closed the same day is dropped
+    cursor.execute(
+        'UPDATE inetnum2supernet SET valid_to = ? WHERE inetnum_id = ? AND supernet_inetnum_id = ? AND valid_to = ?',
+        (day, child_id, parent_id, OPEN_END)
+    )
+    cursor.execute(
+        'DELETE FROM inetnum2supernet WHERE inetnum_id = ? AND supernet_inetnum_id = ? AND valid_from >= valid_to',
+        (child_id, parent_id)
+    )
+
+def store_supernet(db_path: str, all_networks: list, ip_type: str, supernet_date: str):
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
+    day = int(supernet_date)
 
     network_ids = {network['value']: network['id'] for network in all_networks}
     tree = NetworksHierarchicalTree(all_networks)
     tree.build()
 
+    # relationships currently open for networks of this ip type
+    open_edges = cursor.execute((
+        'SELECT e.inetnum_id, e.supernet_inetnum_id FROM inetnum2supernet AS e '
+        'JOIN inetnum AS net ON net.id = e.inetnum_id WHERE e.valid_to = ? AND net.ip_type = ?'
+    ), (OPEN_END, ip_type)).fetchall()
+    open_edges = dict(open_edges)
+
     nb = 0
+    nb_closed = 0
     for node in tree.nodes.values():
-        if node.parent is None:
+        child_id = network_ids[node.block]
+        parent_id = network_ids[tree.nodes[node.parent].block] if node.parent is not None else None
+        current_parent_id = open_edges.pop(child_id, None)
+        if current_parent_id == parent_id:
             continue
 
         if nb > 0 and nb % 50000 == 0:
             conn.commit()
             print(f'Processed {nb} records')
 
-        parent = tree.nodes[node.parent]
-        cursor.execute(
-            f'INSERT OR IGNORE INTO inetnum2supernet (inetnum_id, supernet_inetnum_id, first_seen) VALUES (?, ?, ?)', 
-            (network_ids[node.block], network_ids[parent.block], supernet_date)
-        )
-        nb += 1
+        if current_parent_id is not None:
+            _close_supernet(cursor, day, child_id, current_parent_id)
+            nb_closed += 1
+
+        if parent_id is not None:
+            cursor.execute(
+                'INSERT OR REPLACE INTO inetnum2supernet (inetnum_id, supernet_inetnum_id, valid_from, valid_to) VALUES (?, ?, ?, ?)',
+                (child_id, parent_id, day, OPEN_END)
+            )
+            nb += 1
+
+    # the networks left are not live anymore
+    for child_id, parent_id in open_edges.items():
+        _close_supernet(cursor, day, child_id, parent_id)
+        nb_closed += 1
     conn.commit()
-    print(f'Processed {nb} records')
+    print(f'Processed {nb} records, closed {nb_closed} relationships')
     conn.close()
 
 
@@ -45,9 +86,9 @@ if __name__ == '__main__':
     data_date = sys.argv[1]
 
     print(f'Storing supernets of IPv4 networks')
-    all_networks = get_networks(db_path, 'ipv4')
-    store_supernet(db_path, all_networks, data_date)
+    all_networks = get_networks(db_path, 'ipv4', data_date)
+    store_supernet(db_path, all_networks, 'ipv4', data_date)
 
     print(f'Storing supernets of IPv6 networks')
-    all_networks = get_networks(db_path, 'ipv6')
-    store_supernet(db_path, all_networks, data_date)
+    all_networks = get_networks(db_path, 'ipv6', data_date)
+    store_supernet(db_path, all_networks, 'ipv6', data_date)
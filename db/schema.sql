@@ -41,42 +41,100 @@ CREATE TABLE cc (
     UNIQUE(value)
 );
 
+-- valid_to is the first day the relationship is not seen anymore, 99991231 while it holds
 CREATE TABLE inetnum2supernet (
     inetnum_id int,
     supernet_inetnum_id int,
-    first_seen text,
-    UNIQUE(inetnum_id, supernet_inetnum_id)
+    valid_from int,
+    valid_to int,
+    UNIQUE(inetnum_id, supernet_inetnum_id, valid_from)
 );
+CREATE index idx_inetnum2supernet_inetnum_id on inetnum2supernet(inetnum_id, valid_from, valid_to, supernet_inetnum_id);
+CREATE index idx_inetnum2supernet_supernet_inetnum_id on inetnum2supernet(supernet_inetnum_id, valid_from, valid_to, inetnum_id);
+CREATE index idx_inetnum2supernet_valid_to on inetnum2supernet(valid_to, inetnum_id, supernet_inetnum_id);
 
+-- prefixes announced by an ASN, valid_to is the first day it is not announced anymore, 99991231 while it is
+CREATE TABLE asn2inetnum (
+    asn int,
+    inetnum_id int,
+    valid_from int,
+    valid_to int,
+    UNIQUE(asn, inetnum_id, valid_from)
+);
+CREATE index idx_asn2inetnum_asn on asn2inetnum(asn, valid_from, valid_to, inetnum_id);
+
+-- requestor IDs of the stats seen holding blocks transferred to an org, valid_to is the day the requestor ID is linked to another org, 99991231 while it is not
 CREATE TABLE requestor2org (
     requestor_id int,
     org_id int,
-    UNIQUE(requestor_id, org_id)
+    valid_from int,
+    valid_to int,
+    UNIQUE(requestor_id, org_id, valid_from)
+);
+CREATE index idx_requestor2org_org_id on requestor2org(org_id, valid_from, valid_to, requestor_id);
+CREATE index idx_requestor2org_requestor_id on requestor2org(requestor_id, valid_to, org_id);
+
+CREATE TABLE source (
+    id integer primary key,
+    value text,
+    UNIQUE(value)
 );
 
 CREATE TABLE timeline_inetnum (
     id integer primary key,
-    date_download text,
-    date_registry text,
+    date_download int,
+    date_registry int,
     change_type text,
     inetnum_id int,
-    old_value text,
-    new_value text,
-    source text,
-    UNIQUE(date_registry, change_type, inetnum_id, old_value, new_value)
+    old_value int,
+    new_value int,
+    source_id int
 );
-CREATE index idx_timeline_inetnum_id_change_type on timeline_inetnum(inetnum_id, change_type);
+-- old_value is NULL for the first value seen (new_value for a withdrawn announcement): NULLs being distinct in a UNIQUE constraint, events are deduplicated on IFNULL
+CREATE UNIQUE index idx_timeline_inetnum_unique on timeline_inetnum(date_registry, change_type, inetnum_id, IFNULL(old_value, -1), IFNULL(new_value, -1));
+CREATE index idx_timeline_inetnum_id_change_type on timeline_inetnum(inetnum_id, change_type, date_download, id, new_value);
+CREATE index idx_timeline_inetnum_date_download on timeline_inetnum(date_download, change_type, inetnum_id, old_value, new_value);
 
 
 CREATE TABLE timeline_asn (
     id integer primary key,
-    date_download text,
-    date_registry text,
+    date_download int,
+    date_registry int,
     change_type text,
     asn int,
-    old_value text,
-    new_value text,
-    source text,
-    UNIQUE(date_registry, change_type, asn, old_value, new_value)
+    old_value int,
+    new_value int,
+    source_id int
 );
-CREATE index idx_timeline_asn_change_type on timeline_asn(asn, change_type);
+CREATE UNIQUE index idx_timeline_asn_unique on timeline_asn(date_registry, change_type, asn, IFNULL(old_value, -1), IFNULL(new_value, -1));
+CREATE index idx_timeline_asn_change_type on timeline_asn(asn, change_type, date_download, id, new_value);
+CREATE index idx_timeline_asn_date_download on timeline_asn(date_download, change_type, asn, old_value, new_value);
+
+
+-- addresses moved per value of each change type of timeline_inetnum, ipv6 is counted in /64 to fit in integers
+CREATE TABLE rollup_daily (
+    day int,
+    change_type text,
+    value_id int,
+    ip_type text,
+    addresses_gained int,
+    addresses_lost int,
+    prefixes_gained int,
+    prefixes_lost int,
+    UNIQUE(change_type, value_id, day, ip_type)
+);
+CREATE index idx_rollup_daily_change_type_day on rollup_daily(change_type, ip_type, day, value_id, addresses_gained, addresses_lost, prefixes_gained, prefixes_lost);
+CREATE index idx_rollup_daily_day on rollup_daily(day);
+
+-- address space held per requestor, and per org through the requestor IDs linked to it on a given day (valid_from <= day < valid_to).
+-- Transfers only give the net space an org bought or sold.
+CREATE VIEW holdings AS
+SELECT 'requestor' AS holder_type, value_id AS holder_id, 'requestor' AS via, day, ip_type,
+    addresses_gained - addresses_lost AS addresses, prefixes_gained - prefixes_lost AS prefixes, 0 AS valid_from, 99991231 AS valid_to
+FROM rollup_daily WHERE change_type = 'requestor'
+UNION ALL
+SELECT 'org', value_id, 'net transfer', day, ip_type, addresses_gained - addresses_lost, prefixes_gained - prefixes_lost, 0, 99991231
+FROM rollup_daily WHERE change_type = 'org'
+UNION ALL
+SELECT 'org', l.org_id, 'requestor', r.day, r.ip_type, r.addresses_gained - r.addresses_lost, r.prefixes_gained - r.prefixes_lost, l.valid_from, l.valid_to
+FROM requestor2org AS l CROSS JOIN rollup_daily AS r ON r.change_type = 'requestor' AND r.value_id = l.requestor_id;
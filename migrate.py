@@ -0,0 +1,216 @@
+import os
+import re
+import sqlite3
+from rollup import rollup_day
+from connect_data import OPEN_END
+from store import link_requestor_org
+
+
+def _read_schema(db_schema: str):
+    with open(db_schema, mode='r', encoding='utf8') as fp:
+        schema = '\n'.join([line for line in fp.read().splitlines() if not line.startswith('--')])
+    return [s.strip() for s in schema.split(';') if s.strip() != '']
+
+def _schema_statements(db_schema: str, table: str):
+    # CREATE TABLE / VIEW / index statements of schema.sql concerning a given table, table first
+    tables = []
+    indexes = []
+    for statement in _read_schema(db_schema):
+        match = re.match(r'CREATE (?:TABLE|VIEW) (\w+)', statement, re.IGNORECASE)
+        if match and match.group(1) == table:
+            tables.append(statement)
+        match = re.match(r'CREATE (?:UNIQUE )?index \w+ on (\w+)', statement, re.IGNORECASE)
+        if match and match.group(1) == table:
+            indexes.append(statement)
+
+    return tables, indexes
+
+def _table_columns(cursor: sqlite3.Cursor, table: str):
+    return [row[1] for row in cursor.execute(f'PRAGMA table_info({table})').fetchall()]
+
+def _normalize_sql(sql: str):
+    return ' '.join(sql.lower().split())
+
+def _create_missing_table(cursor: sqlite3.Cursor, db_schema: str, table: str):
+    if cursor.execute('SELECT name FROM sqlite_master WHERE type IN ("table", "view") AND name = ?', (table,)).fetchone():
+        return False
+
+    tables, indexes = _schema_statements(db_schema, table)
+    for statement in tables + indexes:
+        cursor.execute(statement)
+    return True
+
+def _rename_old(cursor: sqlite3.Cursor, table: str):
+    # keep the data under {table}_old, dropping its indexes to free their names
+    cursor.execute(f'ALTER TABLE {table} RENAME TO {table}_old')
+    for index in cursor.execute('SELECT name FROM sqlite_master WHERE type = "index" AND tbl_name = ? AND sql IS NOT NULL', (f'{table}_old',)).fetchall():
+        cursor.execute(f'DROP INDEX {index[0]}')
+
+def _migrate_timeline(cursor: sqlite3.Cursor, db_schema: str, table: str, key_column: str):
+    print(f'Migrating {table} to the compact layout')
+    _rename_old(cursor, table)
+
+    # the unique index is created before the copy so that duplicated events are dropped, the others after
+    tables, indexes = _schema_statements(db_schema, table)
+    unique_indexes = [statement for statement in indexes if statement.upper().startswith('CREATE UNIQUE')]
+    for statement in tables + unique_indexes:
+        cursor.execute(statement)
+
+    cursor.execute(f'INSERT OR IGNORE INTO source (value) SELECT DISTINCT source FROM {table}_old')
+    cursor.execute((
+        f'INSERT OR IGNORE INTO {table} (id, date_download, date_registry, change_type, {key_column}, old_value, new_value, source_id) '
+        'SELECT t.id, CAST(t.date_download AS integer), '
+        "CASE WHEN t.date_registry != '' AND t.date_registry NOT GLOB '*[^0-9]*' THEN CAST(t.date_registry AS integer) ELSE 0 END, "
+        f"t.change_type, t.{key_column}, CAST(NULLIF(t.old_value, '') AS integer), CAST(t.new_value AS integer), s.id "
+        f'FROM {table}_old AS t '
+        'JOIN source AS s ON s.value = t.source '
+        'ORDER BY t.id'
+    ))
+    print(f'Copied {cursor.rowcount} records')
+
+    for statement in indexes:
+        if statement not in unique_indexes:
+            cursor.execute(statement)
+    cursor.execute(f'DROP TABLE {table}_old')
+
+def migrate_compact_timelines(conn: sqlite3.Connection, db_schema: str):
+    cursor = conn.cursor()
+    if 'source_id' in _table_columns(cursor, 'timeline_inetnum'):
+        print('Timelines already in compact layout. Skipping')
+        return
+
+    _create_missing_table(cursor, db_schema, 'source')
+    _migrate_timeline(cursor, db_schema, 'timeline_inetnum', 'inetnum_id')
+    _migrate_timeline(cursor, db_schema, 'timeline_asn', 'asn')
+
+def migrate_rollups(conn: sqlite3.Connection, db_schema: str):
+    cursor = conn.cursor()
+    if not _create_missing_table(cursor, db_schema, 'rollup_daily'):
+        print('Rollups already created. Skipping')
+        return
+
+    print('Computing daily rollups')
+    for day in cursor.execute('SELECT DISTINCT date_download FROM timeline_inetnum ORDER BY date_download').fetchall():
+        rollup_day(cursor, day[0])
+
+def migrate_supernet_intervals(conn: sqlite3.Connection, db_schema: str):
+    cursor = conn.cursor()
+    if 'first_seen' not in _table_columns(cursor, 'inetnum2supernet'):
+        print('Supernets already stored as intervals. Skipping')
+        return
+
+    # a relationship is considered valid until the next supernet seen for the same network
+    print('Migrating inetnum2supernet to validity intervals')
+    _rename_old(cursor, 'inetnum2supernet')
+    tables, indexes = _schema_statements(db_schema, 'inetnum2supernet')
+    for statement in tables:
+        cursor.execute(statement)
+    cursor.execute((
+        'INSERT OR IGNORE INTO inetnum2supernet (inetnum_id, supernet_inetnum_id, valid_from, valid_to) '
+        'SELECT inetnum_id, supernet_inetnum_id, valid_from, valid_to FROM ('
+        'SELECT inetnum_id, supernet_inetnum_id, CAST(first_seen AS integer) AS valid_from, '
+        'COALESCE(LEAD(CAST(first_seen AS integer)) OVER (PARTITION BY inetnum_id ORDER BY CAST(first_seen AS integer)), ?) AS valid_to '
+        'FROM inetnum2supernet_old'
+        ') WHERE valid_from < valid_to'
+    ), (OPEN_END,))
+    print(f'Copied {cursor.rowcount} records')
+
+    for statement in indexes:
+        cursor.execute(statement)
+    cursor.execute('DROP TABLE inetnum2supernet_old')
+
+def migrate_asn2inetnum(conn: sqlite3.Connection, db_schema: str):
+    cursor = conn.cursor()
+    if not _create_missing_table(cursor, db_schema, 'asn2inetnum'):
+        print('ASN index already created. Skipping')
+        return
+
+    # an announcement lasts until the next asn event of the same network
+    print('Indexing prefixes announced by ASNs')
+    cursor.execute((
+        'INSERT OR IGNORE INTO asn2inetnum (asn, inetnum_id, valid_from, valid_to) '
+        'SELECT asn, inetnum_id, valid_from, valid_to FROM ('
+        'SELECT new_value AS asn, inetnum_id, date_download AS valid_from, '
+        'COALESCE(LEAD(date_download) OVER (PARTITION BY inetnum_id ORDER BY date_download, id), ?) AS valid_to '
+        "FROM timeline_inetnum WHERE change_type = 'asn'"
+        ') WHERE asn IS NOT NULL AND valid_from < valid_to'
+    ), (OPEN_END,))
+    print(f'Indexed {cursor.rowcount} records')
+
+def migrate_holdings(conn: sqlite3.Connection, db_schema: str):
+    cursor = conn.cursor()
+    if 'valid_from' not in _table_columns(cursor, 'requestor2org'):
+        # links were never stored before, they are rebuilt day by day from the timeline
+        print('Linking requestor IDs to orgs')
+        cursor.execute('DROP TABLE requestor2org')
+        tables, indexes = _schema_statements(db_schema, 'requestor2org')
+        for statement in tables + indexes:
+            cursor.execute(statement)
+        days = cursor.execute("SELECT DISTINCT date_download FROM timeline_inetnum WHERE change_type IN ('org', 'requestor') ORDER BY date_download").fetchall()
+        for day in days:
+            link_requestor_org(cursor, day[0])
+
+    # the view is recreated when defined differently in schema.sql
+    tables, _ = _schema_statements(db_schema, 'holdings')
+    current = cursor.execute('SELECT sql FROM sqlite_master WHERE type = "view" AND name = "holdings"').fetchone()
+    if current is not None and _normalize_sql(current[0]) == _normalize_sql(tables[0]):
+        print('Holdings already created. Skipping')
+        return
+
+    print('Creating holdings view')
+    cursor.execute('DROP VIEW IF EXISTS holdings')
+    cursor.execute(tables[0])
+
+def migrate_indexes(conn: sqlite3.Connection, db_schema: str):
+    # (re)create the indexes of schema.sql missing or defined differently in the database
+    cursor = conn.cursor()
+    for statement in _read_schema(db_schema):
+        match = re.match(r'CREATE (?:UNIQUE )?index (\w+) on (\w+)', statement, re.IGNORECASE)
+        if match is None:
+            continue
+
+        index_name = match.group(1)
+        table_exists = cursor.execute('SELECT name FROM sqlite_master WHERE type = "table" AND name = ?', (match.group(2),)).fetchone()
+        current = cursor.execute('SELECT sql FROM sqlite_master WHERE type = "index" AND name = ?', (index_name,)).fetchone()
+        if table_exists is None or (current is not None and _normalize_sql(current[0]) == _normalize_sql(statement)):
+            continue
+
+        print(f'Creating index {index_name}')
+        cursor.execute(f'DROP INDEX IF EXISTS {index_name}')
+        cursor.execute(statement)
+
+
+MIGRATIONS = [
+    migrate_compact_timelines,
+    migrate_rollups,
+    migrate_supernet_intervals,
+    migrate_asn2inetnum,
+    migrate_holdings,
+    migrate_indexes,
+]
+
+def migrate(db_path: str, db_schema: str):
+    conn = sqlite3.connect(db_path)
+    for migration in MIGRATIONS:
+        # each migration is all or nothing, including its DDL statements
+        conn.execute('BEGIN')
+        try:
+            migration(conn, db_schema)
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    size_before = os.path.getsize(db_path)
+    print('Reclaiming free space')
+    conn.execute('VACUUM')
+    conn.close()
+    size_after = os.path.getsize(db_path)
+    print(f'Database size went from {size_before} to {size_after} bytes')
+
+
+if __name__ == '__main__':
+    db_path = os.path.join('.', 'db', 'vizir.sqlite3')
+    db_schema = os.path.join('.', 'db', 'schema.sql')
+
+    migrate(db_path, db_schema)
@@ -1,3 +1,5 @@
+import sys
+import json
 import ipaddress
 import random
 import time
@@ -17,10 +19,19 @@ class NetworkNode:
         self.cidr = network['cidr']
         self.nb_ips = net.num_addresses
         self.ip_type = network['ip_type']
-        self.desc = 'n/a'
+        # desc is the diff of a changed network, context describes a network added for its relationship to them
+        self.desc = {}
+        self.context = None
     
     def __repr__(self):
-        return f"{self.block}, parent: {self.parent}, nb children: {len(self.children)}, desc: {self.desc}"
+        return f"{self.block}, parent: {self.parent}, nb children: {len(self.children)}, desc: {self.desc}, context: {self.context}"
+
+    def text_desc(self):
+        if self.context is not None:
+            return self.context
+        if len(self.desc) > 0:
+            return str(self.desc)
+        return 'n/a'
 
 
 
@@ -75,15 +86,57 @@ class NetworksHierarchicalTree:
         if len(self.roots) == 0:
             return "Empty tree"
         
-        for root in self.roots:
-            self.print_from_node(root, "", True)
+        self.render(sys.stdout, 'text')
     
     def print_from_node(self, node: NetworkNode, prefix: str, is_last: bool):
-        print(prefix + ("└── " if is_last else "├── ") + f"{node.block} ({node.desc})")
-        for i, child in enumerate(node.children):
-            is_child_last = True if i == len(node.children) - 1 else False
+        for line in self.iter_text_lines(node, prefix, is_last):
+            print(line)
+
+    def iter_text_lines(self, node: NetworkNode, prefix: str, is_last: bool):
+        # depth first with an explicit stack, deep hierarchies do not hit the recursion limit
+        stack = [(node, prefix, is_last)]
+        while len(stack) > 0:
+            node, prefix, is_last = stack.pop()
+            yield prefix + ("└── " if is_last else "├── ") + f"{node.block} ({node.text_desc()})"
             new_prefix = prefix + ("    " if is_last else "│   ")
-            self.print_from_node(child, new_prefix, is_child_last)
+            for i in reversed(range(len(node.children))):
+                stack.append((node.children[i], new_prefix, i == len(node.children) - 1))
+
+    def node_to_dict(self, node: NetworkNode):
+        return {'block': node.block, 'parent': node.parent, 'ip_type': node.ip_type, 'cidr': node.cidr, 'desc': node.desc, 'context': node.context}
+
+    def render(self, sink, output_format: str = 'text'):
+        # stream the tree to a file-like sink, one node at a time
+        if output_format == 'text':
+            for root in self.roots:
+                for line in self.iter_text_lines(root, "", True):
+                    sink.write(line + '\n')
+
+        elif output_format == 'ndjson':
+            stack = list(reversed(self.roots))
+            while len(stack) > 0:
+                node = stack.pop()
+                sink.write(json.dumps(self.node_to_dict(node)) + '\n')
+                stack.extend(reversed(node.children))
+
+        elif output_format == 'json':
+            # nested objects, the closing of a node's children is pushed on the stack before them
+            sink.write('[')
+            stack = [(root, i == 0) for i, root in reversed(list(enumerate(self.roots)))]
+            while len(stack) > 0:
+                node, is_first = stack.pop()
+                if node is None:
+                    sink.write(']}')
+                    continue
+                if not is_first:
+                    sink.write(', ')
+                sink.write(json.dumps(self.node_to_dict(node))[:-1] + ', "children": [')
+                stack.append((None, False))
+                stack.extend([(child, i == 0) for i, child in reversed(list(enumerate(node.children)))])
+            sink.write(']\n')
+
+        else:
+            raise ValueError(f'Unknown output format {output_format}')
         
     def test_performance(self, nb_networks: int) -> float:
         networks = []
@@ -0,0 +1,53 @@
+import sys
+import os
+import sqlite3
+
+
+# size of a block in addresses for ipv4, in /64 for ipv6
+BLOCK_SIZE = "CASE WHEN net.ip_type = 'ipv4' THEN 1 << (32 - net.cidr) WHEN net.cidr <= 64 THEN 1 << (64 - net.cidr) ELSE 0 END"
+
+def rollup_day(cursor: sqlite3.Cursor, day: int):
+    cursor.execute('DELETE FROM rollup_daily WHERE day = ?', (day,))
+    cursor.execute((
+        'INSERT INTO rollup_daily (day, change_type, value_id, ip_type, addresses_gained, addresses_lost, prefixes_gained, prefixes_lost) '
+        'SELECT ?, change_type, value_id, ip_type, SUM(addresses_gained), SUM(addresses_lost), SUM(prefixes_gained), SUM(prefixes_lost) '
+        'FROM ('
+        f'SELECT t.change_type AS change_type, t.new_value AS value_id, net.ip_type AS ip_type, {BLOCK_SIZE} AS addresses_gained, 0 AS addresses_lost, 1 AS prefixes_gained, 0 AS prefixes_lost '
+        'FROM timeline_inetnum AS t JOIN inetnum AS net ON t.inetnum_id = net.id '
+        'WHERE t.date_download = ? AND t.new_value IS NOT NULL '
+        'UNION ALL '
+        f'SELECT t.change_type, t.old_value, net.ip_type, 0, {BLOCK_SIZE}, 0, 1 '
+        'FROM timeline_inetnum AS t JOIN inetnum AS net ON t.inetnum_id = net.id '
+        'WHERE t.date_download = ? AND t.old_value IS NOT NULL'
+        ') '
+        'GROUP BY change_type, value_id, ip_type'
+    ), (day, day, day))
+
+    return cursor.rowcount
+
+def store_rollups(db_path: str, rollup_date: str):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    nb = rollup_day(cursor, int(rollup_date))
+    conn.commit()
+    print(f'Stored {nb} rollup records for {rollup_date}')
+    conn.close()
+
+def rebuild_rollups(db_path: str):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    days = cursor.execute('SELECT DISTINCT date_download FROM timeline_inetnum ORDER BY date_download').fetchall()
+    for day in days:
+        nb = rollup_day(cursor, day[0])
+        conn.commit()
+        print(f'Stored {nb} rollup records for {day[0]}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    db_path = os.path.join('.', 'db', 'vizir.sqlite3')
+
+    if len(sys.argv) > 1:
+        store_rollups(db_path, sys.argv[1])
+    else:
+        rebuild_rollups(db_path)
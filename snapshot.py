@@ -0,0 +1,66 @@
+import csv
+import gzip
+import ipaddress
+
+
+# a prefix is keyed by a single integer sorting on ip version, then first address, then prefix length
+def prefix_to_key(network) -> int:
+    return (network.version << 136) | (int(network.network_address) << 8) | network.prefixlen
+
+def key_to_prefix(key: int):
+    version = key >> 136
+    start = (key >> 8) & ((1 << 128) - 1)
+    prefixlen = key & 0xff
+    if version == 4:
+        return ipaddress.IPv4Network((start, prefixlen))
+    return ipaddress.IPv6Network((start, prefixlen))
+
+def network_to_key(network: str) -> int:
+    # same as prefix_to_key(ipaddress.ip_network(network, strict=False)) without building the network object
+    address, _, prefixlen = network.partition('/')
+    if ':' in address:
+        version, nb_bits, start = 6, 128, int(ipaddress.IPv6Address(address))
+    else:
+        version, nb_bits = 4, 32
+        a, b, c, d = address.split('.')
+        start = (int(a) << 24) | (int(b) << 16) | (int(c) << 8) | int(d)
+    prefixlen = int(prefixlen) if prefixlen != '' else nb_bits
+    start &= ((1 << nb_bits) - 1) ^ ((1 << (nb_bits - prefixlen)) - 1)
+    return (version << 136) | (start << 8) | prefixlen
+
+def snapshot_from_rows(rows) -> list:
+    # (network, asn) pairs to a snapshot sorted by key, the last asn of a duplicated prefix wins
+    snapshot = {}
+    for network, asn in rows:
+        snapshot[network_to_key(network)] = asn
+    return sorted(snapshot.items())
+
+def _read_ip2asn_rows(filepaths: list):
+    for filepath in filepaths:
+        with gzip.open(filepath, mode='rt', encoding='utf8') as fp:
+            reader = csv.DictReader(fp, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            for row in reader:
+                if row['asn'] == '':
+                    continue
+                yield row['network'], int(row['asn'][2:])
+
+def read_ip2asn_snapshot(filepaths: list) -> list:
+    return snapshot_from_rows(_read_ip2asn_rows(filepaths))
+
+def diff_snapshots(previous: list, current: list):
+    # merge-join of two sorted snapshots, yields (key, old_asn, new_asn)
+    # old_asn is None for an added prefix, new_asn is None for a withdrawn one
+    i = 0
+    j = 0
+    while i < len(previous) or j < len(current):
+        if j == len(current) or (i < len(previous) and previous[i][0] < current[j][0]):
+            yield previous[i][0], previous[i][1], None
+            i += 1
+        elif i == len(previous) or current[j][0] < previous[i][0]:
+            yield current[j][0], None, current[j][1]
+            j += 1
+        else:
+            if previous[i][1] != current[j][1]:
+                yield current[j][0], previous[i][1], current[j][1]
+            i += 1
+            j += 1
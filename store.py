@@ -4,8 +4,10 @@ import json
 import sqlite3
 import ipaddress
 import time
-import gzip
-import csv
+from connect_data import OPEN_END
+from archive import checkout
+from rollup import store_rollups
+from snapshot import read_ip2asn_snapshot, snapshot_from_rows, diff_snapshots, key_to_prefix
 
 
 def create_schema(db_path: str, db_schema: str):
@@ -21,8 +23,21 @@ def create_schema(db_path: str, db_schema: str):
         cursor.executescript(fp.read())
     conn.close()
 
+def to_day(value: str) -> int:
+    # dates are stored as %Y%m%d integers, 0 when the registry gives none
+    value = value.strip()
+    if not value.isdigit():
+        return 0
+    return int(value)
+
+def _store_source(cursor: sqlite3.Cursor, filepath: str):
+    cursor.execute('INSERT OR IGNORE INTO source (value) VALUES (?)', (filepath,))
+    source_id = cursor.execute('SELECT id FROM source WHERE value = ?', (filepath,)).fetchone()['id']
+
+    return source_id
+
 def timeline_stat_inetnum(
-        cursor: sqlite3.Cursor, filepath: str, data_date: str, date_registry: str,  
+        cursor: sqlite3.Cursor, source_id: int, data_date: int, date_registry: int,  
         value : str, cidr_or_nb_ips: int, record_type: str, status_id: int, requestor_id: int, cc_id: int
 ):
     ip_start = ipaddress.ip_address(value)
@@ -39,36 +54,37 @@ def timeline_stat_inetnum(
 
     # update the timeline
     for change_type, new_value in zip(['status', 'requestor', 'cc'], [status_id, requestor_id, cc_id]):
-        last_event = cursor.execute('SELECT * FROM timeline_inetnum WHERE inetnum_id = ? AND change_type = ? ORDER BY id DESC LIMIT 1', (inetnum_id, change_type)).fetchone()
-        if last_event is None or last_event['new_value'] != str(new_value):
-            old_value = last_event['new_value'] if last_event is not None else ''
+        last_event = cursor.execute('SELECT new_value FROM timeline_inetnum WHERE inetnum_id = ? AND change_type = ? ORDER BY date_download DESC, id DESC LIMIT 1', (inetnum_id, change_type)).fetchone()
+        if last_event is None or last_event['new_value'] != new_value:
+            old_value = last_event['new_value'] if last_event is not None else None
             cursor.execute((
-                'INSERT OR IGNORE INTO timeline_inetnum (date_download, date_registry, change_type, inetnum_id, old_value, new_value, source) '
+                'INSERT OR IGNORE INTO timeline_inetnum (date_download, date_registry, change_type, inetnum_id, old_value, new_value, source_id) '
                 'VALUES (?, ?, ?, ?, ?, ?, ?)'
-            ), (data_date, date_registry, change_type, inetnum_id, old_value, str(new_value), filepath))
+            ), (data_date, date_registry, change_type, inetnum_id, old_value, new_value, source_id))
 
 def timeline_stat_asn(
-    cursor: sqlite3.Cursor, filepath: str, data_date: str, date_registry: str,  
+    cursor: sqlite3.Cursor, source_id: int, data_date: int, date_registry: int,  
     asn : int, status_id: int, requestor_id: int, cc_id: int
 ):
     # update the timeline
     for change_type, new_value in zip(['status', 'requestor', 'cc'], [status_id, requestor_id, cc_id]):
-        last_event = cursor.execute('SELECT * FROM timeline_asn WHERE asn = ? AND change_type = ? ORDER BY id DESC LIMIT 1', (asn, change_type)).fetchone()
-        if last_event is None or last_event['new_value'] != str(new_value):
-            old_value = last_event['new_value'] if last_event is not None else ''
+        last_event = cursor.execute('SELECT new_value FROM timeline_asn WHERE asn = ? AND change_type = ? ORDER BY date_download DESC, id DESC LIMIT 1', (asn, change_type)).fetchone()
+        if last_event is None or last_event['new_value'] != new_value:
+            old_value = last_event['new_value'] if last_event is not None else None
             cursor.execute((
-                'INSERT OR IGNORE INTO timeline_asn (date_download, date_registry, change_type, asn, old_value, new_value, source) '
+                'INSERT OR IGNORE INTO timeline_asn (date_download, date_registry, change_type, asn, old_value, new_value, source_id) '
                 'VALUES (?, ?, ?, ?, ?, ?, ?)'
-            ), (data_date, date_registry, change_type, asn, old_value, str(new_value), filepath))
+            ), (data_date, date_registry, change_type, asn, old_value, new_value, source_id))
 
 
-def _process_stat_files(db_path: str, data_path: str, data_date: str):
+def _process_stat_files(db_path: str, data_path: str, data_date: int):
     conn = sqlite3.connect(db_path)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     for filename in os.listdir(data_path):
         filepath = os.path.join(data_path, filename)
         print(f'Parsing {filepath}')
+        source_id = _store_source(cursor, filepath)
         with open(filepath, mode='r', encoding='utf8') as fp:
             nb = 0
             for line in fp:
@@ -89,7 +105,7 @@ def _process_stat_files(db_path: str, data_path: str, data_date: str):
                 cc = record[1]
                 record_type = record[2]
                 value = record[3]
-                date_registry = record[5]
+                date_registry = to_day(record[5])
                 status = record[6]
                 requestor = record[7] if len(record) > 7 else ''
 
@@ -102,9 +118,9 @@ def _process_stat_files(db_path: str, data_path: str, data_date: str):
 
                 # store timelines
                 if record_type in ['ipv4', 'ipv6']:
-                    timeline_stat_inetnum(cursor, filepath, data_date, date_registry, value, int(record[4]), record_type, status_id, requestor_id, cc_id)
+                    timeline_stat_inetnum(cursor, source_id, data_date, date_registry, value, int(record[4]), record_type, status_id, requestor_id, cc_id)
                 elif record_type == 'asn':
-                    timeline_stat_asn(cursor, filepath, data_date, date_registry, int(value), status_id, requestor_id, cc_id)
+                    timeline_stat_asn(cursor, source_id, data_date, date_registry, int(value), status_id, requestor_id, cc_id)
                 nb += 1
 
         conn.commit()
@@ -112,7 +128,7 @@ def _process_stat_files(db_path: str, data_path: str, data_date: str):
 
     conn.close()
 
-def _timeline_transfer_inetnum(cursor: sqlite3.Cursor, filepath: str, data_date: str, date_registry: str, old_value_id: int, new_value_id: int, inetnums: list):
+def _timeline_transfer_inetnum(cursor: sqlite3.Cursor, source_id: int, data_date: int, date_registry: int, old_value_id: int, new_value_id: int, inetnums: list):
     for inetnum in inetnums:
         
         ip_start = inetnum['start_address']
@@ -134,11 +150,11 @@ def _timeline_transfer_inetnum(cursor: sqlite3.Cursor, filepath: str, data_date:
 
         # update timeline
         cursor.execute((
-            'INSERT OR IGNORE INTO timeline_inetnum (date_download, date_registry, change_type, inetnum_id, old_value, new_value, source) '
+            'INSERT OR IGNORE INTO timeline_inetnum (date_download, date_registry, change_type, inetnum_id, old_value, new_value, source_id) '
             'VALUES (?, ?, ?, ?, ?, ?, ?)'
-        ), (data_date, date_registry, 'org', inetnum_id, str(old_value_id), str(new_value_id), filepath))
+        ), (data_date, date_registry, 'org', inetnum_id, old_value_id, new_value_id, source_id))
 
-def _timeline_transfer_asn(cursor: sqlite3.Cursor, filepath: str, data_date: str, date_registry: str, old_value_id: int, new_value_id: int, asns: list):
+def _timeline_transfer_asn(cursor: sqlite3.Cursor, source_id: int, data_date: int, date_registry: int, old_value_id: int, new_value_id: int, asns: list):
     for asn_block in asns:
         asn_start = int(asn_block['start'])
         asn_end = int(asn_block['end'])
@@ -146,9 +162,9 @@ def _timeline_transfer_asn(cursor: sqlite3.Cursor, filepath: str, data_date: str
         for asn in range(asn_start, asn_end + 1):
             # update timeline
             cursor.execute((
-                'INSERT OR IGNORE INTO timeline_asn (date_download, date_registry, change_type, asn, old_value, new_value, source) '
+                'INSERT OR IGNORE INTO timeline_asn (date_download, date_registry, change_type, asn, old_value, new_value, source_id) '
                 'VALUES (?, ?, ?, ?, ?, ?, ?)'
-            ), (data_date, date_registry, 'org', asn, str(old_value_id), str(new_value_id), filepath))
+            ), (data_date, date_registry, 'org', asn, old_value_id, new_value_id, source_id))
 
 def _store_transfer_org(cursor: sqlite3.Cursor, org: str):
     if org is None:
@@ -159,13 +175,14 @@ def _store_transfer_org(cursor: sqlite3.Cursor, org: str):
 
     return org_id
 
-def _process_transfer_files(db_path: str, data_path: str, data_date: str):
+def _process_transfer_files(db_path: str, data_path: str, data_date: int):
     conn = sqlite3.connect(db_path)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     for filename in os.listdir(data_path):
         filepath = os.path.join(data_path, filename)
         print(f'Parsing {filepath}')
+        source_id = _store_source(cursor, filepath)
         with open(filepath, mode='r', encoding='utf8') as fp:
             transfers = json.load(fp)
  
@@ -179,7 +196,7 @@ def _process_transfer_files(db_path: str, data_path: str, data_date: str):
                 conn.commit()
                 print(f'Processed {nb} transfers')
  
-            registry_date = transfer['transfer_date'].replace('-', '').replace('T', ' ').split(' ')[0]
+            registry_date = to_day(transfer['transfer_date'].replace('-', '').replace('T', ' ').split(' ')[0])
             src_org_id = _store_transfer_org(cursor, transfer['source_organization']['name'])
             dst_org_id = _store_transfer_org(cursor, transfer['recipient_organization']['name'])
 
@@ -194,7 +211,7 @@ def _process_transfer_files(db_path: str, data_path: str, data_date: str):
                         inetnums = inetnums[0]['transfer_set']
                     if isinstance(inetnums, dict):
                         inetnums = inetnums['transfer_set']
-                    _timeline_transfer_inetnum(cursor, filepath, data_date, registry_date, src_org_id, dst_org_id, inetnums)
+                    _timeline_transfer_inetnum(cursor, source_id, data_date, registry_date, src_org_id, dst_org_id, inetnums)
                     nb += len(inetnums)
             
             if 'asns' in transfer:
@@ -203,60 +220,140 @@ def _process_transfer_files(db_path: str, data_path: str, data_date: str):
                     asns = asns[0]
                 if isinstance(asns, dict):
                     asns = asns['transfer_set']
-                _timeline_transfer_asn(cursor, filepath, data_date, registry_date, src_org_id, dst_org_id, asns)
+                _timeline_transfer_asn(cursor, source_id, data_date, registry_date, src_org_id, dst_org_id, asns)
                 nb += len(asns)
         conn.commit()
         print(f'Processed {nb} transfers')
     conn.close()
 
-def _process_ip2asn_files(db_path: str, data_path: str, data_date: str):
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    for filename in os.listdir(data_path):
-        filepath = os.path.join(data_path, filename)
-        print(f'Parsing {filepath}')
+def _store_asn2inetnum(cursor: sqlite3.Cursor, data_date: int, inetnum_id: int, old_asn: int, new_asn: int):
+    # close the announcement by the previous ASN, an interval opened and closed the same day is dropped
+    if old_asn is not None:
+        cursor.execute('UPDATE asn2inetnum SET valid_to = ? WHERE asn = ? AND inetnum_id = ? AND valid_to = ?', (data_date, old_asn, inetnum_id, OPEN_END))
+        cursor.execute('DELETE FROM asn2inetnum WHERE asn = ? AND inetnum_id = ? AND valid_from >= valid_to', (old_asn, inetnum_id))
+
+    if new_asn is not None:
+        cursor.execute(
+            'INSERT OR REPLACE INTO asn2inetnum (asn, inetnum_id, valid_from, valid_to) VALUES (?, ?, ?, ?)',
+            (new_asn, inetnum_id, data_date, OPEN_END)
+        )
+
+def link_requestor_org(cursor: sqlite3.Cursor, data_date: int):
+    # a block with a new org or requestor that day links its requestor ID to its org, which ends the link to any other org
+    asof_value = (
+        'SELECT a.new_value FROM timeline_inetnum AS a '
+        "WHERE a.inetnum_id = t.inetnum_id AND a.change_type = '{change_type}' AND a.date_download <= ? "
+        'ORDER BY a.date_download DESC, a.id DESC LIMIT 1'
+    )
+    links = cursor.execute((
+        'SELECT requestor_id, MAX(org_id) FROM ('
+        f"SELECT ({asof_value.format(change_type='requestor')}) AS requestor_id, ({asof_value.format(change_type='org')}) AS org_id "
+        'FROM timeline_inetnum AS t '
+        "WHERE t.date_download = ? AND t.change_type IN ('org', 'requestor')"
+        ') '
+        'WHERE requestor_id IS NOT NULL AND org_id IS NOT NULL '
+        "AND requestor_id NOT IN (SELECT id FROM requestor WHERE value = '') "
+        "AND org_id NOT IN (SELECT id FROM org WHERE value = '') "
+        'GROUP BY requestor_id'
+    ), (data_date, data_date, data_date)).fetchall()
+
+    nb = 0
+    for requestor_id, org_id in links:
+        current = cursor.execute('SELECT org_id FROM requestor2org WHERE requestor_id = ? AND valid_to = ?', (requestor_id, OPEN_END)).fetchone()
+        if current is not None and current[0] == org_id:
+            continue
 
-        nb = 0
-        with gzip.open(filepath, mode='rt', encoding='utf8') as fp:
-            reader = csv.DictReader(fp, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            for row in reader:
-                if row['asn'] == '':
-                    continue
+        # an interval opened and closed the same day is dropped
+        if current is not None:
+            cursor.execute('UPDATE requestor2org SET valid_to = ? WHERE requestor_id = ? AND valid_to = ?', (data_date, requestor_id, OPEN_END))
+            cursor.execute('DELETE FROM requestor2org WHERE requestor_id = ? AND valid_from >= valid_to', (requestor_id,))
+        cursor.execute(
+            'INSERT OR REPLACE INTO requestor2org (requestor_id, org_id, valid_from, valid_to) VALUES (?, ?, ?, ?)',
+            (requestor_id, org_id, data_date, OPEN_END)
+        )
+        nb += 1
 
-                if nb > 0 and nb % 500000 == 0:
-                    conn.commit()
-                    print(f'Processed {nb} records')
+    return nb
 
-                inetnum = ipaddress.ip_network(row['network'], strict=False)
-                # cc = row['country_code']
-                asn = str(row['asn'][2:])
+def _process_requestor_org(db_path: str, data_date: int):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    print(f'Linking requestor IDs to orgs')
+    nb = link_requestor_org(cursor, data_date)
+    conn.commit()
+    print(f'Processed {nb} links')
+    conn.close()
 
-                # store attributes
-                cursor.execute('INSERT OR IGNORE INTO inetnum (value, ip_type, cidr) VALUES (?, ?, ?)', (inetnum.compressed, f'ipv{inetnum.version}', inetnum.prefixlen))
-                inetnum_id = cursor.execute('SELECT id FROM inetnum WHERE value = ?', (inetnum.compressed,)).fetchone()['id']
+def _ip2asn_files(data_path: str):
+    return [os.path.join(data_path, filename) for filename in sorted(os.listdir(data_path))]
 
-                # timeline_inetnum
-                last_event = cursor.execute("SELECT * FROM timeline_inetnum WHERE inetnum_id=? AND change_type='asn' ORDER BY id DESC LIMIT 1", (inetnum_id,)).fetchone()
-                if last_event is None or last_event['new_value'] != asn:
-                    old_value = last_event['new_value'] if last_event is not None else ''
-                    cursor.execute((
-                        'INSERT OR IGNORE INTO timeline_inetnum (date_download, date_registry, change_type, inetnum_id, old_value, new_value, source) '
-                        'VALUES (?, ?, ?, ?, ?, ?, ?)'
-                    ), (data_date, data_date, 'asn', inetnum_id, old_value, asn, filepath))
+def _process_ip2asn_files(db_path: str, data_path: str, data_date: int):
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    filepaths = _ip2asn_files(data_path)
+    if len(filepaths) == 0:
+        print(f'No ip2asn snapshot in {data_path}. Skipping')
+        conn.close()
+        return
 
-                nb += 1
-        conn.commit()
-        print(f'Processed {nb} records')
+    # today's feed against the announcements open in DB, whatever day was stored last: a day stored again or after a gap
+    # only records what differs from the DB
+    for filepath in filepaths:
+        print(f'Parsing {filepath}')
+    current = read_ip2asn_snapshot(filepaths)
+    print(f'Diffing against the prefixes announced in DB')
+    rows = cursor.execute((
+        'SELECT net.value AS value, a.asn AS asn FROM asn2inetnum AS a '
+        'JOIN inetnum AS net ON a.inetnum_id = net.id WHERE a.valid_to = ?'
+    ), (OPEN_END,)).fetchall()
+    previous = snapshot_from_rows([(row['value'], row['asn']) for row in rows])
+    changes = [(key_to_prefix(key), old_asn, new_asn) for key, old_asn, new_asn in diff_snapshots(previous, current)]
+    print(f'Found {len(changes)} changes between {len(previous)} and {len(current)} prefixes')
+
+    # store attributes of the changed prefixes only, ids are resolved with a single join
+    source_id = _store_source(cursor, filepaths[0])
+    cursor.executemany(
+        'INSERT OR IGNORE INTO inetnum (value, ip_type, cidr) VALUES (?, ?, ?)',
+        [(inetnum.compressed, f'ipv{inetnum.version}', inetnum.prefixlen) for inetnum, _, _ in changes]
+    )
+    cursor.execute('CREATE TEMP TABLE ip2asn_changes (value text primary key)')
+    cursor.executemany('INSERT OR IGNORE INTO ip2asn_changes (value) VALUES (?)', [(inetnum.compressed,) for inetnum, _, _ in changes])
+    inetnum_ids = dict(cursor.execute('SELECT c.value, net.id FROM ip2asn_changes AS c JOIN inetnum AS net ON net.value = c.value').fetchall())
+    cursor.execute('DROP TABLE ip2asn_changes')
+
+    # timeline_inetnum
+    nb = {'added': 0, 'withdrawn': 0, 're-originated': 0}
+    for inetnum, old_asn, new_asn in changes:
+        if sum(nb.values()) > 0 and sum(nb.values()) % 500000 == 0:
+            conn.commit()
+            print(f'Processed {sum(nb.values())} records')
+
+        inetnum_id = inetnum_ids[inetnum.compressed]
+        cursor.execute((
+            'INSERT OR IGNORE INTO timeline_inetnum (date_download, date_registry, change_type, inetnum_id, old_value, new_value, source_id) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)'
+        ), (data_date, data_date, 'asn', inetnum_id, old_asn, new_asn, source_id))
+        _store_asn2inetnum(cursor, data_date, inetnum_id, old_asn, new_asn)
+
+        if old_asn is None:
+            nb['added'] += 1
+        elif new_asn is None:
+            nb['withdrawn'] += 1
+        else:
+            nb['re-originated'] += 1
+    conn.commit()
+    print(f"Processed {sum(nb.values())} records: {nb['added']} added, {nb['withdrawn']} withdrawn, {nb['re-originated']} re-originated")
     conn.close()
 
-def _process_asn_files(db_path: str, data_path: str, data_date: str):
+def _process_asn_files(db_path: str, data_path: str, data_date: int):
     conn = sqlite3.connect(db_path)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     for filename in os.listdir(data_path):
         filepath = os.path.join(data_path, filename)
         print(f'Parsing {filepath}')
+        source_id = _store_source(cursor, filepath)
 
         nb = 0
         with open(filepath, mode='r', encoding='utf8') as fp:
@@ -281,14 +378,14 @@ def _process_asn_files(db_path: str, data_path: str, data_date: str):
 
             # timeline_asn
             for change_type, new_value in zip(['cc', 'aso'], [cc_id, aso_id]):
-                last_event = cursor.execute("SELECT * FROM timeline_asn WHERE asn=? AND change_type=? ORDER BY id DESC LIMIT 1", (asn, change_type)).fetchone()
+                last_event = cursor.execute("SELECT new_value FROM timeline_asn WHERE asn=? AND change_type=? ORDER BY date_download DESC, id DESC LIMIT 1", (asn, change_type)).fetchone()
 
-                if last_event is None or last_event['new_value'] != str(new_value):
-                    old_value = last_event['new_value'] if last_event is not None else ''
+                if last_event is None or last_event['new_value'] != new_value:
+                    old_value = last_event['new_value'] if last_event is not None else None
                     cursor.execute((
-                        'INSERT OR IGNORE INTO timeline_asn (date_download, date_registry, change_type, asn, old_value, new_value, source) '
+                        'INSERT OR IGNORE INTO timeline_asn (date_download, date_registry, change_type, asn, old_value, new_value, source_id) '
                         'VALUES (?, ?, ?, ?, ?, ?, ?)'
-                    ), (data_date, data_date, change_type, asn, old_value, new_value, filepath))
+                    ), (data_date, data_date, change_type, asn, old_value, new_value, source_id))
             nb += 1
         conn.commit()
         print(f'Processed {nb} records')
@@ -296,10 +393,20 @@ def _process_asn_files(db_path: str, data_path: str, data_date: str):
 
 
 def store_timelines(db_path: str, data_path: str, data_date: str):
-    _process_stat_files(db_path, os.path.join(data_path, 'stats', data_date), data_date)
-    _process_transfer_files(db_path, os.path.join(data_path, 'transfers', data_date), data_date)
-    _process_ip2asn_files(db_path, os.path.join(data_path, 'ip2asn', data_date), data_date)
-    _process_asn_files(db_path, os.path.join(data_path, 'asn', data_date), data_date)
+    day = to_day(data_date)
+    with checkout(data_path, 'stats', data_date) as stats_path:
+        _process_stat_files(db_path, stats_path, day)
+    with checkout(data_path, 'transfers', data_date) as transfers_path:
+        _process_transfer_files(db_path, transfers_path, day)
+    _process_requestor_org(db_path, day)
+    with checkout(data_path, 'ip2asn', data_date) as ip2asn_path:
+        _process_ip2asn_files(db_path, ip2asn_path, day)
+    with checkout(data_path, 'asn', data_date) as asn_path:
+        _process_asn_files(db_path, asn_path, day)
+
+    # daily rollups of the events just stored
+    print(f'Storing rollups of address space moved')
+    store_rollups(db_path, data_date)
 
 if __name__ == '__main__':
     data_date = sys.argv[1]
@@ -5,6 +5,7 @@ from datetime import datetime
 from download import download_transfers, download_stats, download_iana_allocations, download_ip2asn, download_asn
 from store import create_schema, store_timelines
 from connect_data import get_networks, store_supernet
+from archive import archive_day
 
 if __name__ == '__main__':
     today = datetime.today().strftime('%Y%m%d')
@@ -32,10 +33,13 @@ if __name__ == '__main__':
 
     # store network relationship
     print(f'Storing supernets of IPv4 networks')
-    all_networks = get_networks(db_path, 'ipv4')
-    store_supernet(db_path, all_networks, today)
+    all_networks = get_networks(db_path, 'ipv4', today)
+    store_supernet(db_path, all_networks, 'ipv4', today)
 
     print(f'Storing supernets of IPv6 networks')
-    all_networks = get_networks(db_path, 'ipv6')
-    store_supernet(db_path, all_networks, today)
+    all_networks = get_networks(db_path, 'ipv6', today)
+    store_supernet(db_path, all_networks, 'ipv6', today)
 
+    # compact the raw data of the day
+    print(f'Archiving data of {today}')
+    archive_day(data_path, today)